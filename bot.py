@@ -1,11 +1,18 @@
+import asyncio
 import os
+import re
 import sqlite3
-from datetime import datetime, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from functools import lru_cache, wraps
+from time import time as epoch_now
 from zoneinfo import ZoneInfo
 
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity, Update
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
@@ -26,6 +33,11 @@ if not TOKEN:
 TZ = ZoneInfo("Asia/Dhaka")
 REMINDER_6PM = time(18, 0, tzinfo=TZ)     # 6:00 PM Dhaka
 REMINDER_1150 = time(23, 50, tzinfo=TZ)   # 11:50 PM Dhaka
+DB_MAINTENANCE = time(4, 0, tzinfo=TZ)    # 4:00 AM Dhaka (quietest hour)
+SEND_CONCURRENCY = 20                     # sends in flight per scheduled job
+SEND_RATE_PER_SEC = 25                    # below Telegram's ~30 msg/s bulk limit
+SEND_MAX_RETRIES = 3                      # retries after a RetryAfter (flood control)
+KEYBOARD_CACHE_SIZE = 1024                # memoized check-in keyboards
 
 HELP_TEXT = (
     "✅ Commands:\n"
@@ -68,11 +80,12 @@ TEXT_ONLY_NOTICE = (
 # =========================
 # DB (SQLite)
 # =========================
-conn = sqlite3.connect("data.db", check_same_thread=False)
-conn.row_factory = sqlite3.Row
+DB_PATH = "data.db"
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA = """
+BEGIN IMMEDIATE;
 
-conn.executescript(
-    """
 CREATE TABLE IF NOT EXISTS users (
   user_id INTEGER PRIMARY KEY,
   chat_id INTEGER NOT NULL,
@@ -95,10 +108,109 @@ CREATE TABLE IF NOT EXISTS notes (
   PRIMARY KEY(user_id, date)
 );
 
-CREATE INDEX IF NOT EXISTS idx_tasks_user_date ON tasks(user_id, date);
+-- Superseded by idx_tasks_user_date_done, which has the same leading columns
+DROP INDEX IF EXISTS idx_tasks_user_date;
+CREATE INDEX IF NOT EXISTS idx_tasks_user_date_done ON tasks(user_id, date, done);
+
+COMMIT;
+"""
+
+# Every query runs on this one thread, which owns the connection below
+DB_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+
+def on_db_thread(fn):
+    @wraps(fn)
+    async def run(*args):
+        return await asyncio.get_running_loop().run_in_executor(DB_EXEC, fn, *args)
+
+    return run
+
+
+def open_conn() -> sqlite3.Connection:
+    # Autocommit mode: single-statement writes commit on their own, batches go through txn()
+    c = sqlite3.connect(DB_PATH, cached_statements=STATEMENT_CACHE_SIZE, isolation_level=None)
+    c.executescript(
+        """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=134217728;
+PRAGMA cache_size=-20000;
+PRAGMA analysis_limit=400;
+"""
+    )
+    c.executescript(SCHEMA)
+    init_stats(c)
+    return c
+
+
+def init_stats(c: sqlite3.Connection) -> None:
+    # A bare PRAGMA optimize on a new connection has no query history and does nothing
+    if sqlite3.sqlite_version_info >= (3, 46, 0):
+        c.execute("PRAGMA optimize=0x10002")
+    elif c.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone() is None:
+        # Older SQLite: gather statistics once (bounded by analysis_limit) if none exist yet
+        c.execute("ANALYZE")
+
+
+# Single connection for reads and writes. With every query on one thread a read-only
+# pool buys no concurrency, and one connection keeps one warm page cache.
+# Rows come back as plain tuples; queries that need named columns set a row
+# factory on their own cursor.
+conn = DB_EXEC.submit(open_conn).result()
+
+
+@contextmanager
+def txn():
+    # Group several writes into one commit. Not reentrant: a nested txn() fails on BEGIN
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        # A failed COMMIT leaves the transaction open; SQLite may also have rolled back already
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+# =========================
+# SQL
+# =========================
+# Hoisted so every call hands sqlite3 the same string and hits its statement cache
+SQL_UPSERT_USER = """
+INSERT INTO users(user_id, chat_id) VALUES (?, ?)
+ON CONFLICT(user_id) DO UPDATE SET chat_id=excluded.chat_id
+"""
+SQL_LIST_TASKS = "SELECT task_id, text, done FROM tasks WHERE user_id=? AND date=? ORDER BY task_id ASC"
+SQL_LIST_TASKS_WITH_NOTE = """
+SELECT t.task_id, t.text, t.done,
+       (SELECT note FROM notes WHERE user_id=? AND date=?) AS note
+FROM tasks t WHERE t.user_id=? AND t.date=? ORDER BY t.task_id ASC
 """
+SQL_ADD_TASK = "INSERT INTO tasks(user_id, date, text) VALUES (?, ?, ?)"
+SQL_DELETE_TASK = "DELETE FROM tasks WHERE task_id=?"
+SQL_DELETE_TASKS_FOR_DAY = "DELETE FROM tasks WHERE user_id=? AND date=?"
+SQL_TOGGLE_TASK = "UPDATE tasks SET done = CASE done WHEN 1 THEN 0 ELSE 1 END WHERE task_id=? RETURNING done"
+SQL_TASK_COUNTS = "SELECT COUNT(*), COALESCE(SUM(done), 0) FROM tasks WHERE user_id=? AND date=?"
+SQL_TASK_BELONGS = "SELECT 1 FROM tasks WHERE user_id=? AND date=? AND task_id=? LIMIT 1"
+SQL_CLAIM_6PM = (
+    "UPDATE users SET last_6pm_date=? WHERE last_6pm_date IS NULL OR last_6pm_date <> ? "
+    "RETURNING user_id, chat_id"
 )
-conn.commit()
+SQL_CLAIM_1150 = (
+    "UPDATE users SET last_1150_date=? WHERE last_1150_date IS NULL OR last_1150_date <> ? "
+    "RETURNING user_id, chat_id"
+)
+SQL_RELEASE_6PM = "UPDATE users SET last_6pm_date=NULL WHERE user_id=?"
+SQL_RELEASE_1150 = "UPDATE users SET last_1150_date=NULL WHERE user_id=?"
+SQL_SET_NOTE = """
+INSERT INTO notes(user_id, date, note) VALUES (?, ?, ?)
+ON CONFLICT(user_id, date) DO UPDATE SET note=excluded.note
+"""
+SQL_GET_NOTE = "SELECT note FROM notes WHERE user_id=? AND date=?"
+SQL_DELETE_NOTE = "DELETE FROM notes WHERE user_id=? AND date=?"
 
 
 # =========================
@@ -108,107 +220,211 @@ def now_dhaka() -> datetime:
     return datetime.now(TZ)
 
 
+# [date string, epoch seconds of the next Dhaka midnight]
+_today_cache: list = ["", 0.0]
+
+
 def today_str() -> str:
-    return now_dhaka().date().isoformat()
+    # Recomputed only once the cached day has ended
+    if epoch_now() >= _today_cache[1]:
+        today = now_dhaka().date()
+        midnight = datetime.combine(today + timedelta(days=1), time(0), tzinfo=TZ)
+        _today_cache[:] = [today.isoformat(), midnight.timestamp()]
+    return _today_cache[0]
 
 
-def upsert_user(user_id: int, chat_id: int) -> None:
-    conn.execute(
-        """
-INSERT INTO users(user_id, chat_id) VALUES (?, ?)
-ON CONFLICT(user_id) DO UPDATE SET chat_id=excluded.chat_id
-""",
-        (user_id, chat_id),
-    )
-    conn.commit()
+def _upsert_user(user_id: int, chat_id: int) -> None:
+    conn.execute(SQL_UPSERT_USER, (user_id, chat_id))
 
 
-def list_tasks(user_id: int, date_str: str):
-    cur = conn.execute(
-        "SELECT task_id, text, done FROM tasks WHERE user_id=? AND date=? ORDER BY task_id ASC",
-        (user_id, date_str),
-    )
-    return cur.fetchall()
+# user_id -> (date, rows) for the last day listed; one entry per user keeps it bounded
+_task_cache: dict[int, tuple[str, list]] = {}
+
+
+def dict_row(cursor: sqlite3.Cursor, row: tuple) -> dict:
+    # Task rows are dicts so a cached list can be patched after a toggle
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+def cached_tasks(user_id: int, date_str: str):
+    cached = _task_cache.get(user_id)
+    return cached[1] if cached and cached[0] == date_str else None
+
+
+def invalidate_tasks(user_id: int, date_str: str) -> None:
+    cached = _task_cache.get(user_id)
+    if cached and cached[0] == date_str:
+        del _task_cache[user_id]
+
+
+def _list_tasks(user_id: int, date_str: str):
+    tasks = cached_tasks(user_id, date_str)
+    if tasks is not None:
+        return tasks
+
+    cur = conn.execute(SQL_LIST_TASKS, (user_id, date_str))
+    cur.row_factory = dict_row
+    tasks = cur.fetchall()
+    _task_cache[user_id] = (date_str, tasks)
+    return tasks
 
 
-def add_task(user_id: int, date_str: str, text: str) -> None:
-    conn.execute("INSERT INTO tasks(user_id, date, text) VALUES (?, ?, ?)", (user_id, date_str, text))
-    conn.commit()
+def _list_tasks_with_note(user_id: int, date_str: str):
+    # /today needs both; fetch them in one round trip unless the tasks are already cached
+    tasks = cached_tasks(user_id, date_str)
+    if tasks is not None:
+        return tasks, _get_note(user_id, date_str)
 
+    cur = conn.execute(SQL_LIST_TASKS_WITH_NOTE, (user_id, date_str, user_id, date_str))
+    cur.row_factory = dict_row
+    tasks = cur.fetchall()
+    _task_cache[user_id] = (date_str, tasks)
+    return tasks, tasks[0]["note"] if tasks else None
 
-def delete_task(task_id: int) -> None:
-    conn.execute("DELETE FROM tasks WHERE task_id=?", (task_id,))
-    conn.commit()
 
+def _add_task(user_id: int, date_str: str, text: str) -> None:
+    conn.execute(SQL_ADD_TASK, (user_id, date_str, text))
+    invalidate_tasks(user_id, date_str)
 
-def delete_all_tasks_for_day(user_id: int, date_str: str) -> int:
-    cur = conn.execute("DELETE FROM tasks WHERE user_id=? AND date=?", (user_id, date_str))
-    conn.commit()
+
+def _delete_task(user_id: int, date_str: str, task_id: int) -> None:
+    conn.execute(SQL_DELETE_TASK, (task_id,))
+    invalidate_tasks(user_id, date_str)
+
+
+def _reset_day(user_id: int, date_str: str) -> int:
+    # Two deletes; run it through _with_user so both land in the caller's transaction
+    cur = conn.execute(SQL_DELETE_TASKS_FOR_DAY, (user_id, date_str))
+    conn.execute(SQL_DELETE_NOTE, (user_id, date_str))
+    invalidate_tasks(user_id, date_str)
     return cur.rowcount
 
 
-def toggle_task(task_id: int) -> None:
-    conn.execute("UPDATE tasks SET done = CASE done WHEN 1 THEN 0 ELSE 1 END WHERE task_id=?", (task_id,))
-    conn.commit()
+def _toggle_task(user_id: int, date_str: str, task_id: int) -> None:
+    row = conn.execute(SQL_TOGGLE_TASK, (task_id,)).fetchone()
+    tasks = cached_tasks(user_id, date_str)
+    if tasks is None:
+        return
+    if row is None:
+        invalidate_tasks(user_id, date_str)
+        return
+    # Swap in a patched copy so the next keyboard render is served from the cache
+    done = row[0]
+    patched = [{**t, "done": done} if t["task_id"] == task_id else t for t in tasks]
+    _task_cache[user_id] = (date_str, patched)
 
 
-def task_belongs_to_user_today(user_id: int, task_id: int, date_str: str) -> bool:
-    cur = conn.execute(
-        "SELECT 1 FROM tasks WHERE user_id=? AND date=? AND task_id=? LIMIT 1",
-        (user_id, date_str, task_id),
-    )
-    return cur.fetchone() is not None
+def _task_counts(user_id: int, date_str: str) -> tuple[int, int]:
+    total, done = conn.execute(SQL_TASK_COUNTS, (user_id, date_str)).fetchone()
+    return total, done
 
 
-def set_last_sent(user_id: int, which: str, date_str: str) -> None:
-    if which == "6pm":
-        conn.execute("UPDATE users SET last_6pm_date=? WHERE user_id=?", (date_str, user_id))
-    elif which == "1150":
-        conn.execute("UPDATE users SET last_1150_date=? WHERE user_id=?", (date_str, user_id))
-    conn.commit()
+def _task_belongs_to_user_today(user_id: int, task_id: int, date_str: str) -> bool:
+    tasks = cached_tasks(user_id, date_str)
+    if tasks is not None:
+        return any(t["task_id"] == task_id for t in tasks)
 
+    return conn.execute(SQL_TASK_BELONGS, (user_id, date_str, task_id)).fetchone() is not None
 
-def due_users(which: str, date_str: str):
-    if which == "6pm":
-        cur = conn.execute(
-            "SELECT user_id, chat_id FROM users WHERE last_6pm_date IS NULL OR last_6pm_date <> ?",
-            (date_str,),
-        )
-    else:
-        cur = conn.execute(
-            "SELECT user_id, chat_id FROM users WHERE last_1150_date IS NULL OR last_1150_date <> ?",
-            (date_str,),
-        )
-    return cur.fetchall()
 
+def _claim_due_users(which: str, date_str: str):
+    # Mark users as sent and return their (user_id, chat_id) in the same statement
+    sql = SQL_CLAIM_6PM if which == "6pm" else SQL_CLAIM_1150
+    return conn.execute(sql, (date_str, date_str)).fetchall()
+
+
+def _release_users(user_ids, which: str) -> None:
+    # Undo a claim for users whose message could not be delivered
+    sql = SQL_RELEASE_6PM if which == "6pm" else SQL_RELEASE_1150
+    with txn():
+        conn.executemany(sql, [(uid,) for uid in user_ids])
+
+
+def _set_note(user_id: int, date_str: str, note: str) -> None:
+    conn.execute(SQL_SET_NOTE, (user_id, date_str, note))
+
+
+def _get_note(user_id: int, date_str: str) -> str | None:
+    row = conn.execute(SQL_GET_NOTE, (user_id, date_str)).fetchone()
+    return row[0] if row else None
+
+
+def _maintain_db() -> None:
+    # Re-analyze tables whose statistics drifted, judged from the queries this connection
+    # has run since startup, and fold the WAL back into the main file
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def _with_user(user_id: int, chat_id: int, write, *args):
+    # Register the user and apply one write in the same transaction
+    with txn():
+        _upsert_user(user_id, chat_id)
+        return write(*args)
 
-def set_note(user_id: int, date_str: str, note: str) -> None:
-    conn.execute(
-        """
-INSERT INTO notes(user_id, date, note) VALUES (?, ?, ?)
-ON CONFLICT(user_id, date) DO UPDATE SET note=excluded.note
-""",
-        (user_id, date_str, note),
-    )
-    conn.commit()
 
+# Async entry points for the handlers; each runs its sync counterpart on the DB thread
+upsert_user = on_db_thread(_upsert_user)
+with_user = on_db_thread(_with_user)
+list_tasks = on_db_thread(_list_tasks)
+list_tasks_with_note = on_db_thread(_list_tasks_with_note)
+toggle_task = on_db_thread(_toggle_task)
+task_counts = on_db_thread(_task_counts)
+task_belongs_to_user_today = on_db_thread(_task_belongs_to_user_today)
+claim_due_users = on_db_thread(_claim_due_users)
+release_users = on_db_thread(_release_users)
+get_note = on_db_thread(_get_note)
+maintain_db = on_db_thread(_maintain_db)
 
-def get_note(user_id: int, date_str: str) -> str | None:
-    cur = conn.execute("SELECT note FROM notes WHERE user_id=? AND date=?", (user_id, date_str))
-    row = cur.fetchone()
-    return row["note"] if row else None
 
+_MD_SPAN = re.compile(r"\*([^*]+)\*|`([^`]+)`")
 
-def delete_note(user_id: int, date_str: str) -> None:
-    conn.execute("DELETE FROM notes WHERE user_id=? AND date=?", (user_id, date_str))
-    conn.commit()
+
+def utf16_len(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+
+def markdown_to_entities(md: str) -> tuple[str, tuple[MessageEntity, ...]]:
+    # Resolve the *bold* / `code` subset of legacy Markdown into plain text + entities once,
+    # so replies can skip parse_mode. Offsets are in UTF-16 code units, as the Bot API expects.
+    parts = []
+    entities = []
+    offset = 0
+    pos = 0
+    for m in _MD_SPAN.finditer(md):
+        before = md[pos : m.start()]
+        parts.append(before)
+        offset += utf16_len(before)
+
+        bold, code = m.groups()
+        inner = bold if bold is not None else code
+        kind = MessageEntity.BOLD if bold is not None else MessageEntity.CODE
+        length = utf16_len(inner)
+        entities.append(MessageEntity(type=kind, offset=offset, length=length))
+        parts.append(inner)
+        offset += length
+        pos = m.end()
+    parts.append(md[pos:])
+    return "".join(parts), tuple(entities)
+
+
+HOW_IT_WORKS_TEXT, HOW_IT_WORKS_ENTITIES = markdown_to_entities(HOW_IT_WORKS_MD)
 
 
 def clamp(s: str, n: int = 32) -> str:
-    s = s.strip()
+    # Task text is stripped once in add_command, so no need to strip on every render
     return s if len(s) <= n else s[: n - 1] + "…"
 
 
+def render_task_list(header: str, tasks) -> str:
+    # One flat buffer of fragments and a single join, rather than a formatted line per task
+    buf = [header]
+    write = buf.extend
+    for t in tasks:
+        write(("\n", str(t["task_id"]), ". ", "✅" if t["done"] else "⬜", " ", t["text"]))
+    return "".join(buf)
+
+
 def build_checkin_text(tasks, date_str: str) -> str:
     total = len(tasks)
     done = sum(1 for t in tasks if t["done"] == 1)
@@ -220,10 +436,16 @@ def build_checkin_text(tasks, date_str: str) -> str:
 
 
 def build_checkin_keyboard(tasks) -> InlineKeyboardMarkup:
+    return _build_checkin_keyboard(tuple((t["task_id"], t["done"], t["text"]) for t in tasks))
+
+
+# Markups are immutable in PTB, so one instance per task-state signature can be shared
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _build_checkin_keyboard(tasks: tuple[tuple[int, int, str], ...]) -> InlineKeyboardMarkup:
     rows = []
-    for t in tasks:
-        prefix = "✅" if t["done"] == 1 else "⬜"
-        rows.append([InlineKeyboardButton(f"{prefix} {clamp(t['text'])}", callback_data=f"t:{t['task_id']}")])
+    for task_id, done, text in tasks:
+        prefix = "✅" if done == 1 else "⬜"
+        rows.append([InlineKeyboardButton(f"{prefix} {clamp(text)}", callback_data=f"t:{task_id}")])
 
     rows.append(
         [
@@ -248,7 +470,7 @@ def feedback_text(done: int, total: int) -> str:
 
 
 async def send_6pm_reminder(app, chat_id: int, user_id: int, date_str: str):
-    tasks = list_tasks(user_id, date_str)
+    tasks = await list_tasks(user_id, date_str)
     if not tasks:
         await app.bot.send_message(
             chat_id,
@@ -256,12 +478,11 @@ async def send_6pm_reminder(app, chat_id: int, user_id: int, date_str: str):
         )
         return
 
-    lines = [f"{t['task_id']}. {'✅' if t['done'] else '⬜'} {t['text']}" for t in tasks]
-    await app.bot.send_message(chat_id, f"⏰ 6:00 PM Reminder ({date_str})\nHere are your tasks:\n" + "\n".join(lines))
+    await app.bot.send_message(chat_id, render_task_list(f"⏰ 6:00 PM Reminder ({date_str})\nHere are your tasks:", tasks))
 
 
 async def send_1150_checkin(app, chat_id: int, user_id: int, date_str: str):
-    tasks = list_tasks(user_id, date_str)
+    tasks = await list_tasks(user_id, date_str)
     if not tasks:
         await app.bot.send_message(chat_id, f"🌙 11:50 PM Check-in ({date_str})\nNo tasks were set today.")
         return
@@ -275,8 +496,8 @@ async def send_1150_checkin(app, chat_id: int, user_id: int, date_str: str):
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    upsert_user(user_id, chat_id)
-    await update.message.reply_text(HOW_IT_WORKS_MD, parse_mode="Markdown")
+    await upsert_user(user_id, chat_id)
+    await update.message.reply_text(HOW_IT_WORKS_TEXT, entities=HOW_IT_WORKS_ENTITIES)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -286,31 +507,28 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    upsert_user(user_id, chat_id)
 
     text = " ".join(context.args).strip()
     if not text:
+        await upsert_user(user_id, chat_id)
         await update.message.reply_text("Usage: /add <task>\nType /help to see commands.")
         return
 
     d = today_str()
-    add_task(user_id, d, text)
+    await with_user(user_id, chat_id, _add_task, user_id, d, text)
     await update.message.reply_text(f"✅ Added for today ({d}): {text}\nType /help to see commands.")
 
 
 async def today_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     d = today_str()
-    tasks = list_tasks(user_id, d)
+    tasks, note = await list_tasks_with_note(user_id, d)
 
     if not tasks:
         await update.message.reply_text(f"Today ({d}) you have no tasks. Use /add <task>.\nType /help to see commands.")
         return
 
-    lines = [f"{t['task_id']}. {'✅' if t['done'] else '⬜'} {t['text']}" for t in tasks]
-    note = get_note(user_id, d)
-
-    msg = f"🗓️ {d} — Your Tasks\n" + "\n".join(lines)
+    msg = render_task_list(f"🗓️ {d} — Your Tasks", tasks)
     if note:
         msg += f"\n\n📝 Your note: {note}"
     else:
@@ -323,57 +541,57 @@ async def today_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def del_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    upsert_user(user_id, chat_id)
 
     if not context.args:
+        await upsert_user(user_id, chat_id)
         await update.message.reply_text("Usage: /del <task_id> (see /today)\nType /help to see commands.")
         return
 
     try:
         task_id = int(context.args[0])
     except ValueError:
+        await upsert_user(user_id, chat_id)
         await update.message.reply_text("Usage: /del <task_id> (must be a number)\nType /help to see commands.")
         return
 
     d = today_str()
-    if not task_belongs_to_user_today(user_id, task_id, d):
+    if not await task_belongs_to_user_today(user_id, task_id, d):
+        await upsert_user(user_id, chat_id)
         await update.message.reply_text("That task ID is not in today’s list. Use /today.\nType /help to see commands.")
         return
 
-    delete_task(task_id)
+    await with_user(user_id, chat_id, _delete_task, user_id, d, task_id)
     await update.message.reply_text(f"🗑️ Deleted task {task_id}.\nType /help to see commands.")
 
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    upsert_user(user_id, chat_id)
 
     d = today_str()
-    deleted = delete_all_tasks_for_day(user_id, d)
-    delete_note(user_id, d)
+    deleted = await with_user(user_id, chat_id, _reset_day, user_id, d)
     await update.message.reply_text(f"🔄 Reset complete for {d}. Deleted {deleted} task(s).\nType /help to see commands.")
 
 
 async def note_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    upsert_user(user_id, chat_id)
 
     note = " ".join(context.args).strip()
     if not note:
+        await upsert_user(user_id, chat_id)
         await update.message.reply_text("Usage: /note <your short feedback>\nType /help to see commands.")
         return
 
     d = today_str()
-    set_note(user_id, d, note)
+    await with_user(user_id, chat_id, _set_note, user_id, d, note)
     await update.message.reply_text(f"📝 Saved note for {d}.\nType /help to see commands.")
 
 
 async def checkin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    upsert_user(user_id, chat_id)
+    await upsert_user(user_id, chat_id)
 
     d = today_str()
     await send_1150_checkin(context.application, chat_id, user_id, d)
@@ -393,28 +611,24 @@ async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("t:"):
         task_id = int(data.split(":", 1)[1])
 
-        if not task_belongs_to_user_today(user_id, task_id, d):
+        if not await task_belongs_to_user_today(user_id, task_id, d):
             await query.answer("Not allowed.", show_alert=True)
             return
 
-        toggle_task(task_id)
-        tasks = list_tasks(user_id, d)
+        await toggle_task(user_id, d, task_id)
+        tasks = await list_tasks(user_id, d)
 
         await query.edit_message_text(build_checkin_text(tasks, d), reply_markup=build_checkin_keyboard(tasks))
         return
 
     if data == "summary":
-        tasks = list_tasks(user_id, d)
-        total = len(tasks)
-        done = sum(1 for t in tasks if t["done"] == 1)
+        total, done = await task_counts(user_id, d)
         await query.answer(f"Done: {done}/{total}")
         return
 
     if data == "finalize":
-        tasks = list_tasks(user_id, d)
-        total = len(tasks)
-        done = sum(1 for t in tasks if t["done"] == 1)
-        note = get_note(user_id, d)
+        total, done = await task_counts(user_id, d)
+        note = await get_note(user_id, d)
 
         msg = f"✅ Final result for {d}: {done}/{total}\n{feedback_text(done, total)}"
         if note:
@@ -429,7 +643,7 @@ async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Text-only enforcement handlers
 # =========================
 async def any_text_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(HOW_IT_WORKS_MD, parse_mode="Markdown")
+    await update.message.reply_text(HOW_IT_WORKS_TEXT, entities=HOW_IT_WORKS_ENTITIES)
 
 
 async def non_text_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -443,26 +657,35 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 # =========================
 # Scheduled jobs
 # =========================
+async def send_to_due_users(app, which: str, send, date_str: str) -> None:
+    # Bounded fan-out; the pace itself is set by the application's AIORateLimiter
+    sem = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def send_one(user_id: int, chat_id: int):
+        async with sem:
+            try:
+                await send(app, chat_id, user_id, date_str)
+            except Exception:
+                return user_id
+        return None
+
+    users = await claim_due_users(which, date_str)
+    results = await asyncio.gather(*(send_one(uid, cid) for uid, cid in users))
+    failed = [uid for uid in results if uid is not None]
+    if failed:
+        await release_users(failed, which)
+
+
 async def job_6pm(context: ContextTypes.DEFAULT_TYPE):
-    app = context.application
-    d = today_str()
-    for u in due_users("6pm", d):
-        try:
-            await send_6pm_reminder(app, u["chat_id"], u["user_id"], d)
-            set_last_sent(u["user_id"], "6pm", d)
-        except Exception:
-            pass
+    await send_to_due_users(context.application, "6pm", send_6pm_reminder, today_str())
 
 
 async def job_1150(context: ContextTypes.DEFAULT_TYPE):
-    app = context.application
-    d = today_str()
-    for u in due_users("1150", d):
-        try:
-            await send_1150_checkin(app, u["chat_id"], u["user_id"], d)
-            set_last_sent(u["user_id"], "1150", d)
-        except Exception:
-            pass
+    await send_to_due_users(context.application, "1150", send_1150_checkin, today_str())
+
+
+async def job_db_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    await maintain_db()
 
 
 # =========================
@@ -470,7 +693,8 @@ async def job_1150(context: ContextTypes.DEFAULT_TYPE):
 # =========================
 def main():
     defaults = Defaults(tzinfo=TZ)
-    app = ApplicationBuilder().token(TOKEN).defaults(defaults).build()
+    rate_limiter = AIORateLimiter(overall_max_rate=SEND_RATE_PER_SEC, max_retries=SEND_MAX_RETRIES)
+    app = ApplicationBuilder().token(TOKEN).defaults(defaults).rate_limiter(rate_limiter).build()
 
     # Commands
     app.add_handler(CommandHandler("start", start_command))
@@ -485,24 +709,8 @@ def main():
     # Buttons
     app.add_handler(CallbackQueryHandler(on_button))
 
-    # Non-text content -> show text-only notice (PTB v22+ compatible)
-    app.add_handler(
-        MessageHandler(
-            (
-                filters.PHOTO
-                | filters.VIDEO
-                | filters.VOICE
-                | filters.AUDIO
-                | filters.Document.ALL
-                | filters.Sticker.ALL
-                | filters.ANIMATION
-                | filters.VIDEO_NOTE
-                | filters.CONTACT
-                | filters.LOCATION
-            ),
-            non_text_reply,
-        )
-    )
+    # Non-text content (anything but text and service messages) -> show text-only notice
+    app.add_handler(MessageHandler(~filters.TEXT & ~filters.COMMAND & ~filters.StatusUpdate.ALL, non_text_reply))
 
     # Normal text (non-commands) -> guide
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, any_text_reply))
@@ -513,6 +721,7 @@ def main():
     # Jobs
     app.job_queue.run_daily(job_6pm, time=REMINDER_6PM)
     app.job_queue.run_daily(job_1150, time=REMINDER_1150)
+    app.job_queue.run_daily(job_db_maintenance, time=DB_MAINTENANCE)
 
     run_mode = os.getenv("RUN_MODE", "polling").lower().strip()
 